@@ -1,81 +1,182 @@
 import pandas as pd
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import requests
+import orjson
 import os
 from datetime import datetime
+from collections import OrderedDict
+import time
+import threading
+from requests.adapters import HTTPAdapter
 
-def get_carpark_history(facility_id: str, event_date: str) -> List[Dict]:
-    """
-    Fetch car park history data from the TfNSW API.
-    
-    Args:
-        facility_id (str): The facility ID from df_stations
-        event_date (str): Event date in YYYY-MM-DD format
-        
-    Returns:
-        List[Dict]: List of car park history records
-    """
+CARPARK_HISTORY_URL = "https://api.transport.nsw.gov.au/v1/carpark/history"
+
+# server.py calls into this module from worker threads, so each thread keeps its
+# own pooled keep-alive session; requests.Session is not safe to share across threads
+_LOCAL = threading.local()
+_SESSIONS = []
+_SESSIONS_LOCK = threading.Lock()
+
+# (facility_id, event_date) -> (fetched_at, etag, last_modified, parsed_json)
+HISTORY_CACHE_TTL = 60  # seconds a cached response is served without revalidation
+HISTORY_CACHE_MAXSIZE = 256
+_HISTORY_CACHE = OrderedDict()
+_HISTORY_LOCK = threading.Lock()  # guards _HISTORY_CACHE
+
+def _session() -> requests.Session:
+    """Return the calling thread's HTTP session, creating it on first use."""
+    session = getattr(_LOCAL, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.headers.update({"accept": "application/json"})
+        session.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20))
+        _LOCAL.session = session
+        with _SESSIONS_LOCK:
+            _SESSIONS.append(session)
+    return session
+
+def close():
+    """Close every thread's HTTP session and its pooled connections."""
+    with _SESSIONS_LOCK:
+        sessions = _SESSIONS[:]
+        _SESSIONS.clear()
+    for session in sessions:
+        session.close()
+
+def _get_api_key() -> str:
     api_key = os.getenv('CAR_PARK_API')
     if not api_key:
         raise ValueError("CAR_PARK_API environment variable not set")
-        
-    url = f"https://api.transport.nsw.gov.au/v1/carpark/history"
+    return api_key
+
+def _history_request_args(facility_id: str, event_date: str, api_key: str, cached: Optional[tuple]) -> Tuple[Dict, Dict]:
+    """Build query params and headers, revalidating a stale cache entry if present."""
     params = {
         "facility": facility_id,
         "eventdate": event_date
     }
     headers = {
-        "accept": "application/json",
         "Authorization": f"apikey {api_key}"
     }
-    
-    response = requests.get(url, params=params, headers=headers)
+    if cached is not None:
+        # Revalidate the stale entry with a conditional GET
+        _, etag, last_modified, _ = cached
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+    return params, headers
+
+def _store_history(key: tuple, fetched_at: float, cached: Optional[tuple], response) -> List[Dict]:
+    """Update the cache from a requests response and return the parsed records."""
+    if response.status_code == 304 and cached is not None:
+        _, etag, last_modified, data = cached
+        with _HISTORY_LOCK:
+            _HISTORY_CACHE[key] = (fetched_at, etag, last_modified, data)
+        return data
     response.raise_for_status()
-    return response.json()
+    data = orjson.loads(response.content)
+    
+    with _HISTORY_LOCK:
+        _HISTORY_CACHE[key] = (fetched_at, response.headers.get("ETag"), response.headers.get("Last-Modified"), data)
+        _HISTORY_CACHE.move_to_end(key)
+        if len(_HISTORY_CACHE) > HISTORY_CACHE_MAXSIZE:
+            _HISTORY_CACHE.popitem(last=False)
+    return data
 
-def calculate_carpark_stats(history_data: List[Dict]) -> Dict:
+def _lookup_history(key: tuple, now: float) -> Tuple[Optional[tuple], bool]:
+    """Return the cache entry for key (or None) and whether it is still fresh."""
+    with _HISTORY_LOCK:
+        cached = _HISTORY_CACHE.get(key)
+        if cached is None:
+            return None, False
+        _HISTORY_CACHE.move_to_end(key)
+    return cached, now - cached[0] < HISTORY_CACHE_TTL
+
+def get_carpark_history(facility_id: str, event_date: str) -> List[Dict]:
     """
-    Calculate statistics for a car park from its history data.
+    Fetch car park history data from the TfNSW API.
+    
+    Responses are cached per (facility_id, event_date) for HISTORY_CACHE_TTL
+    seconds and revalidated afterwards with ETag / Last-Modified headers.
     
     Args:
-        history_data (List[Dict]): List of car park history records
+        facility_id (str): The facility ID from df_stations
+        event_date (str): Event date in YYYY-MM-DD format
         
     Returns:
-        Dict: Dictionary containing total spots, availability, and total occupancy
+        List[Dict]: List of car park history records
     """
-    if not history_data:
-        return {
-            "total_spots": 0,
-            "current_availability": 0,
-            "total_occupancy": 0,
-            "is_full": False,
-            "is_almost_full": False
-        }
+    api_key = _get_api_key()
+    key = (facility_id, event_date)
+    now = time.monotonic()
+    cached, fresh = _lookup_history(key, now)
+    if fresh:
+        return cached[3]
     
-    # Get the latest record
-    latest_record = history_data[-1]
+    params, headers = _history_request_args(facility_id, event_date, api_key, cached)
+    response = _session().get(CARPARK_HISTORY_URL, params=params, headers=headers, timeout=10)
+    return _store_history(key, now, cached, response)
+
+def _empty_stats() -> Dict:
+    return {
+        "total_spots": 0,
+        "current_availability": 0,
+        "total_occupancy": 0,
+        "is_full": False,
+        "is_almost_full": False
+    }
+
+def _record_stats(latest_record: Dict, include_facility: bool = False) -> Dict:
+    """
+    Compute statistics from the latest history record in a single pass over its zones.
     
-    # Calculate total spots (sum of spots across all zones)
-    total_spots = sum(int(zone["spots"]) for zone in latest_record["zones"])
+    Args:
+        latest_record (Dict): The most recent car park history record
+        include_facility (bool): Also include facility name, location and zones
+        
+    Returns:
+        Dict: Dictionary containing car park statistics
+    """
+    zones = latest_record["zones"]
     
-    # Calculate total occupancy (sum of total occupancy across all zones)
-    total_occupancy = sum(int(zone["occupancy"]["total"]) for zone in latest_record["zones"])
+    # Sum spots and total occupancy across all zones in a single pass
+    total_spots = 0
+    total_occupancy = 0
+    for zone in zones:
+        total_spots += int(zone["spots"])
+        total_occupancy += int(zone["occupancy"]["total"])
     
     # Calculate availability
     availability = total_spots - total_occupancy
     
-    # Calculate status flags
-    is_full = availability < 1
-    is_almost_full = availability < (total_spots * 0.1)  # Less than 10% available
-    
-    return {
+    stats = {
         "total_spots": total_spots,
         "current_availability": availability,
         "total_occupancy": total_occupancy,
-        "is_full": is_full,
-        "is_almost_full": is_almost_full,
+        "is_full": availability < 1,
+        "is_almost_full": availability < (total_spots * 0.1),  # Less than 10% available
         "last_updated": latest_record["MessageDate"]
     }
+    if include_facility:
+        stats["facility_name"] = latest_record["facility_name"]
+        stats["location"] = latest_record["location"]
+        stats["zones"] = zones
+    return stats
+
+def calculate_carpark_stats(history_data: List[Dict]) -> Dict:
+    """
+    Calculate statistics for a car park from its history data.
+    
+    Args:
+        history_data (List[Dict]): List of car park history records
+        
+    Returns:
+        Dict: Dictionary containing total spots, availability, and total occupancy
+    """
+    if not history_data:
+        return _empty_stats()
+    return _record_stats(history_data[-1])
 
 def get_carpark_status(facility_id: str, event_date: str) -> Dict:
     """
@@ -89,18 +190,11 @@ def get_carpark_status(facility_id: str, event_date: str) -> Dict:
         Dict: Dictionary containing car park status information
     """
     history_data = get_carpark_history(facility_id, event_date)
-    stats = calculate_carpark_stats(history_data)
-    
-    # Add facility information
-    if history_data:
-        latest_record = history_data[-1]
-        stats.update({
-            "facility_name": latest_record["facility_name"],
-            "location": latest_record["location"],
-            "zones": latest_record["zones"]
-        })
+    if not history_data:
+        return _empty_stats()
     
-    return stats
+    # Statistics and facility information from one pass over the latest record
+    return _record_stats(history_data[-1], include_facility=True)
 
 def format_carpark_status(status: Dict) -> str:
     """
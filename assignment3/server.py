@@ -1,21 +1,24 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response
 import plotly.express as px
+import plotly.io as pio
+from plotly.io.json import to_json_plotly
 import pandas as pd
-import json
 from pydantic import BaseModel
 from google import genai
 import os
 from dotenv import load_dotenv
 from geopy.geocoders import Nominatim
-from geopy.distance import geodesic
 import numpy as np
+from scipy.spatial import cKDTree
 from datetime import datetime, timedelta
 import logging
 from rich.logging import RichHandler
 import time
+import asyncio
 from carpark_utils import get_carpark_status, format_carpark_status, get_carpark_history
-from tabulate import tabulate
+import carpark_utils
 
 # Configure rich logging
 logging.basicConfig(
@@ -56,6 +59,26 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("shutdown")
+async def close_http_sessions():
+    """Release pooled connections to the car park API"""
+    carpark_utils.close()
+
+# Plotly settings for the parking history figure, resolved once at startup
+_PLOTLY_TEMPLATE = pio.templates[pio.templates.default]
+HISTORY_FIGURE_LABELS = {
+    'Time': 'Time',
+    'value': 'Number of Spots',
+    'variable': 'Status',
+    'Zone': 'Zone'
+}
+HISTORY_FIGURE_LAYOUT = {
+    'hovermode': 'x unified',
+    'legend_title': 'Status by Zone',
+    'yaxis_title': 'Number of Spots',
+    'xaxis_title': 'Time'
+}
+
 class Query(BaseModel):
     query: str = ""
 
@@ -63,32 +86,73 @@ class SuburbQuery(BaseModel):
     suburb: str
 
 df_stations = pd.read_csv('assignment3/stations.csv')
-df_stations['Coordinates'] = df_stations['Coordinates'].apply(lambda x: tuple(map(float, x.split())))
+# Parse "lat lon" strings once into packed float64 arrays (structure of arrays)
+_STATION_COORDS = np.array([list(map(float, s.split())) for s in df_stations['Coordinates']], dtype=np.float64)
+df_stations['lat'] = _STATION_COORDS[:, 0]
+df_stations['lon'] = _STATION_COORDS[:, 1]
+df_stations = df_stations.drop(columns=['Coordinates'])
+
+# Columns used on the hot path, held as plain NumPy arrays
+_NAMES = df_stations['Name'].to_numpy()
+_IDS = df_stations['ID'].astype(str).to_numpy()
+_SPOTS = df_stations['Number of spots'].to_numpy()
+_FREQ = df_stations['Update Frequency'].to_numpy()
+
+# Station name -> row position, avoids a boolean-mask scan per lookup
+_NAME_INDEX = {name: i for i, name in enumerate(_NAMES)}
+
+# Station coordinates in radians, used to build the KD-tree
+EARTH_RADIUS_KM = 6371.0088
+_LAT_RAD = np.radians(_STATION_COORDS[:, 0])
+_LON_RAD = np.radians(_STATION_COORDS[:, 1])
+_COS_LAT = np.cos(_LAT_RAD)
+
+def _unit_xyz(lat, lon, cos_lat):
+    """Cartesian coordinates on the unit sphere, inputs in radians"""
+    return np.stack([cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)], axis=-1)
+
+# KD-tree over the stations for O(log N) nearest-station queries
+_TREE = cKDTree(_unit_xyz(_LAT_RAD, _LON_RAD, _COS_LAT))
+
+def _closest_station(coords):
+    """Returns (row position, distance in km) of the station nearest a (lat, lon) pair in degrees"""
+    lat0, lon0 = np.radians(coords)
+    chord, idx = _TREE.query(_unit_xyz(lat0, lon0, np.cos(lat0)), k=1)
+    # Convert the straight-line chord to the great-circle arc length
+    return int(idx), float(2 * EARTH_RADIUS_KM * np.arcsin(min(chord / 2, 1.0)))
+
+# Shared geocoder and suburb -> (coordinates, fetched_at) cache
+_GEOLOCATOR = Nominatim(user_agent="parking_assistant", timeout=5)
+GEOCODE_CACHE_TTL = 6 * 60 * 60  # seconds
+_GEOCODE_CACHE = {}
 
 def get_coordinates_from_suburb(suburb: str):
-    geolocator = Nominatim(user_agent="my_agent")
+    key = suburb.strip().lower()
+    cached = _GEOCODE_CACHE.get(key)
+    if cached is not None and time.time() - cached[1] < GEOCODE_CACHE_TTL:
+        return cached[0]
+
     try:
-        location = geolocator.geocode(f"{suburb}, Sydney, Australia")
-        if location:
-            return (location.latitude, location.longitude)
-        return None
+        location = _GEOLOCATOR.geocode(f"{key}, Sydney, Australia")
+        coords = (location.latitude, location.longitude) if location else None
     except Exception as e:
         print(f"Error geocoding suburb: {e}")
         return None
 
+    _GEOCODE_CACHE[key] = (coords, time.time())
+    return coords
+
 def get_closest_suburb(suburb: str):
     """Returns the closest suburb from our station list"""
     suburb_coords = get_coordinates_from_suburb(suburb)
     if not suburb_coords:
         return None
     
-    # Calculate distances
-    distances = df_stations['Coordinates'].apply(lambda x: geodesic(suburb_coords, x).kilometers)
-    closest_idx = distances.idxmin()
+    closest_idx, distance = _closest_station(suburb_coords)
     
     return {
-        'suburb': df_stations.loc[closest_idx, 'Name'].split(' Station')[0],
-        'distance': round(distances[closest_idx], 2)
+        'suburb': _NAMES[closest_idx].split(' Station')[0],
+        'distance': round(distance, 2)
     }
 
 def find_closest_station(suburb: str):
@@ -97,32 +161,45 @@ def find_closest_station(suburb: str):
     if not suburb_coords:
         return None
 
-    # Calculate distances
-    distances = df_stations['Coordinates'].apply(lambda x: geodesic(suburb_coords, x).kilometers)
-    closest_idx = distances.idxmin()
+    closest_idx, distance = _closest_station(suburb_coords)
     
     closest_station = {
-        'name': df_stations.loc[closest_idx, 'Name'],
-        'distance': round(distances[closest_idx], 2),
-        'spots': df_stations.loc[closest_idx, 'Number of spots'],
-        'update_frequency': df_stations.loc[closest_idx, 'Update Frequency']
+        'name': _NAMES[closest_idx],
+        'distance': round(distance, 2),
+        'spots': int(_SPOTS[closest_idx]),
+        'update_frequency': _FREQ[closest_idx]
     }
     
     return closest_station
 
+# [date string, computed_at]; today's date is reformatted at most once a minute
+_TODAY = [None, 0.0]
+
+def _today():
+    """Returns today's date as YYYY-MM-DD"""
+    now = time.time()
+    if now - _TODAY[1] > 60:
+        _TODAY[0] = datetime.fromtimestamp(now).strftime("%Y-%m-%d")
+        _TODAY[1] = now
+    return _TODAY[0]
+
+def _status_for(station_name: str):
+    """Returns the car park status of a station, or None if the station is unknown.
+    Repeat lookups are served from carpark_utils' history cache (fresh for
+    HISTORY_CACHE_TTL seconds, then revalidated), so only the stats are recomputed."""
+    idx = _NAME_INDEX.get(station_name)
+    if idx is None:
+        return None
+    station_id = _IDS[idx]
+    event_date = _today()
+    return get_carpark_status(station_id, event_date)
+
 def get_occupancy_of_station(station_name: str):
     """Gets current occupancy of a station"""
     try:
-        # Get station ID from df_stations
-        station = df_stations[df_stations['Name'] == station_name]
-        if station.empty:
+        status = _status_for(station_name)
+        if status is None:
             return None
-            
-        station_id = str(station.iloc[0]['ID'])
-        event_date = datetime.now().strftime("%Y-%m-%d")
-        
-        # Get car park status
-        status = get_carpark_status(station_id, event_date)
         return status['total_occupancy'] / status['total_spots'] if status['total_spots'] > 0 else 0
     except Exception as e:
         logger.error(f"Error getting occupancy: {e}")
@@ -131,43 +208,37 @@ def get_occupancy_of_station(station_name: str):
 def get_total_spots_of_station(station_name: str):
     """Gets total number of spots at a station"""
     try:
-        station = df_stations[df_stations['Name'] == station_name]
-        if station.empty:
+        status = _status_for(station_name)
+        if status is None:
             return None
-            
-        station_id = str(station.iloc[0]['ID'])
-        event_date = datetime.now().strftime("%Y-%m-%d")
-        
-        # Get car park status
-        status = get_carpark_status(station_id, event_date)
         return status['total_spots']
     except Exception as e:
         logger.error(f"Error getting total spots: {e}")
         return None
 
-def get_parking_history_data_of_the_station(station_name: str, event_date: str = datetime.now().strftime("%Y-%m-%d")):
+def get_parking_history_data_of_the_station(station_name: str, event_date: str = None):
     """Gets historical parking data for a station"""
+    if event_date is None:
+        event_date = _today()
     try:
         # First try to find exact match
-        station = df_stations[df_stations['Name'] == station_name]
+        idx = _NAME_INDEX.get(station_name)
         
         # If no exact match, find closest station
-        if station.empty:
+        if idx is None:
             # Get coordinates of the requested station
             station_coords = get_coordinates_from_suburb(station_name)
             if not station_coords:
                 logger.error(f"Could not find coordinates for station: {station_name}")
                 return None
                 
-            # Calculate distances to all stations
-            distances = df_stations['Coordinates'].apply(lambda x: geodesic(station_coords, x).kilometers)
-            closest_idx = distances.idxmin()
+            # Find the nearest station
+            idx, distance = _closest_station(station_coords)
             
             # Get the closest station
-            station = df_stations.iloc[[closest_idx]]
-            logger.info(f"Using closest station: {station['Name'].iloc[0]} (distance: {round(distances[closest_idx], 2)}km)")
+            logger.info(f"Using closest station: {_NAMES[idx]} (distance: {round(distance, 2)}km)")
             
-        station_id = str(station.iloc[0]['ID'])
+        station_id = _IDS[idx]
         
         # Get historical data from API
         history_data = get_carpark_history(station_id, event_date)
@@ -175,45 +246,55 @@ def get_parking_history_data_of_the_station(station_name: str, event_date: str =
             logger.error(f"No historical data available for station: {station_name}")
             return None
             
-        # Process the data for visualization
-        records = []
-        for record in history_data:
-            timestamp = datetime.strptime(record['MessageDate'], '%Y-%m-%dT%H:%M:%S')
-            for zone in record['zones']:
-                zone_name = f"Zone {zone['zone_id']}"
-                total_spots = int(zone['spots'])
-                occupancy = int(zone['occupancy']['total'])
-                availability = total_spots - occupancy
-                
-                records.append({
-                    'Time': timestamp,
-                    'Zone': zone_name,
-                    'Total Spots': total_spots,
-                    'Occupancy': occupancy,
-                    'Availability': availability,
-                    'Occupancy Rate': occupancy / total_spots if total_spots > 0 else 0
-                })
+        # Process the data for visualization: one row per (record, zone)
+        columns = ['Time', 'Zone', 'Total Spots', 'Occupancy', 'Availability', 'Occupancy Rate']
+        df = pd.json_normalize(history_data, record_path='zones', meta=['MessageDate'])
+        if df.empty:
+            return pd.DataFrame(columns=columns)
+        
+        df['Time'] = pd.to_datetime(df['MessageDate'], format='%Y-%m-%dT%H:%M:%S')
+        df['Zone'] = 'Zone ' + df['zone_id'].astype(str)
+        spots = df['spots'].to_numpy().astype(np.int32)
+        occupancy = df['occupancy.total'].to_numpy().astype(np.int32)
+        df['Total Spots'] = spots
+        df['Occupancy'] = occupancy
+        df['Availability'] = spots - occupancy
+        df['Occupancy Rate'] = np.divide(occupancy, spots, out=np.zeros(len(spots), dtype=np.float64), where=spots > 0)
         
         # Create DataFrame with historical data
-        df = pd.DataFrame(records)
+        df = df[columns]
         return df
     except Exception as e:
         logger.error(f"Error getting parking history: {e}")
         return None
 
+def summarize_parking_history(df: pd.DataFrame):
+    """Summarizes parking history as mean/min/max of the key columns per zone reading,
+    and last as the station total across all zones at the latest time"""
+    if df.empty:
+        return "No parking history records."
+    # The frame has one row per (record, zone), so sum the latest record's zones
+    latest = df[df['Time'] == df['Time'].max()]
+    latest_spots = latest['Total Spots'].sum()
+    latest_occupancy = latest['Occupancy'].sum()
+    last = {
+        'Occupancy': latest_occupancy,
+        'Availability': latest['Availability'].sum(),
+        'Occupancy Rate': latest_occupancy / latest_spots if latest_spots > 0 else 0.0
+    }
+    parts = []
+    for column in ['Occupancy', 'Availability', 'Occupancy Rate']:
+        values = df[column].to_numpy()
+        parts.append(
+            f"{column}: mean={values.mean():.2f}, min={values.min():.2f}, "
+            f"max={values.max():.2f}, last={last[column]:.2f}"
+        )
+    return "; ".join(parts)
+
 def get_carpark_status_for_station(station_name: str):
     """Gets detailed car park status for a station"""
     try:
-        station = df_stations[df_stations['Name'] == station_name]
-        if station.empty:
-            return None
-            
-        station_id = str(station.iloc[0]['ID'])
-        event_date = datetime.now().strftime("%Y-%m-%d")
-        
-        # Get car park status
-        status = get_carpark_status(station_id, event_date)
-        return status
+        return _status_for(station_name)
     except Exception as e:
         logger.error(f"Error getting car park status: {e}")
         return None
@@ -235,12 +316,16 @@ def function_caller(func_name: str, params: list):
     else:
         return f"Unknown function: {func_name}"
 
+def _json_response(content: dict) -> Response:
+    """Serializes a response containing figure dicts in one pass with plotly's encoder"""
+    return Response(content=to_json_plotly(content), media_type="application/json")
+
 @app.post("/parking_query")
 async def parking_query(query: Query):
     max_iterations = 5
     last_response = None
     iteration = 0
-    iteration_response = []
+    history = ""  # Running log of previous iterations, extended once per iteration
     start_time = time.time()
     graphical_data = None  # Track graphical data
 
@@ -250,6 +335,9 @@ async def parking_query(query: Query):
     1. FUNCTION_CALL: python_function_name|input
     2. FINAL_ANSWER: [detailed response]
 
+    Independent function calls, such as the same lookup for several stations, may be
+    given together with ONE FUNCTION_CALL per line.
+
     If there are multiple inputs split them with a comma.
 
     where python_function_name is one of the following:
@@ -262,7 +350,7 @@ async def parking_query(query: Query):
     If any function fails regarding the station name try using the closest station approach.
     Do not show any tables in the output just get some aggregate stats.
 
-    DO NOT include multiple responses. Give ONE response at a time."""
+    DO NOT mix FUNCTION_CALL and FINAL_ANSWER lines. Give ONE response at a time."""
 
     while iteration < max_iterations:
         iteration_start_time = time.time()
@@ -271,83 +359,93 @@ async def parking_query(query: Query):
         if last_response is None:
             current_query = query.query
         else:
-            current_query = query.query + "\n\n" + " ".join(iteration_response)
-            current_query = current_query + "  What should I do next?"
+            current_query = f"{query.query}\n\n{history}  What should I do next?"
 
         # Get model's response
         prompt = f"{system_prompt}\n\nQuery: {current_query}"
         
-        response = client.models.generate_content(
+        response = await client.aio.models.generate_content(
             model="gemini-2.0-flash",
             contents=prompt
         )
         
         response_text = response.text.strip()
         
-        if response_text.startswith("FUNCTION_CALL:"):
-            _, function_info = response_text.split(":", 1)
-            func_name, params = [x.strip() for x in function_info.split("|", 1)]
-            params = params.split(",")
-            logger.info(f"[bold]Executing:[/bold] {func_name}({params})")
+        # Independent calls (e.g. one per station) may come on separate lines
+        calls = []
+        for line in response_text.splitlines():
+            line = line.strip()
+            if line.startswith("FUNCTION_CALL:"):
+                _, function_info = line.split(":", 1)
+                func_name, params = [x.strip() for x in function_info.split("|", 1)]
+                calls.append((func_name, params.split(",")))
+        
+        if calls:
+            for func_name, params in calls:
+                logger.info(f"[bold]Executing:[/bold] {func_name}({params})")
             
-            iteration_result = function_caller(func_name, params)
+            # Station helpers do blocking HTTP, so run them on worker threads; the
+            # fetches overlap and the iteration waits for the slowest, not their sum
+            results = await asyncio.gather(
+                *(asyncio.to_thread(function_caller, func_name, params) for func_name, params in calls)
+            )
             
-            # Create visualization if we have parking history data
-            if func_name == "get_parking_history_data_of_the_station":
-                df = iteration_result
-                if iteration_result is not None:
-                    # Create a figure with secondary y-axis
-                    fig = px.line(df, 
-                                x='Time', 
-                                y=['Occupancy', 'Availability'],
-                                color='Zone',
-                                title='Parking Status by Zone Over Time',
-                                labels={
-                                    'Time': 'Time',
-                                    'value': 'Number of Spots',
-                                    'variable': 'Status',
-                                    'Zone': 'Zone'
-                                })
-                    
-                    # Update layout for better readability
-                    fig.update_layout(
-                        hovermode='x unified',
-                        legend_title='Status by Zone',
-                        yaxis_title='Number of Spots',
-                        xaxis_title='Time'
-                    )
-                    
-                    # Convert the figure to JSON and ensure it matches the expected structure
-                    graph_json = json.loads(fig.to_json())
-                    graphical_data = {
-                        "data": graph_json["data"],
-                        "layout": graph_json["layout"]
-                    }
-
-                    iteration_result = tabulate(df.describe(), headers='keys', tablefmt='grid')
-                else:
-                    iteration_result = "I couldn't find the parking history data for the station."
+            entries = []
+            for (func_name, params), iteration_result in zip(calls, results):
+                # Create visualization if we have parking history data
+                if func_name == "get_parking_history_data_of_the_station":
+                    df = iteration_result
+                    if iteration_result is not None:
+                        # Create a figure with secondary y-axis
+                        fig = px.line(df, 
+                                    x='Time', 
+                                    y=['Occupancy', 'Availability'],
+                                    color='Zone',
+                                    title='Parking Status by Zone Over Time',
+                                    labels=HISTORY_FIGURE_LABELS,
+                                    template=_PLOTLY_TEMPLATE)
+                        
+                        # Update layout for better readability
+                        fig.update_layout(**HISTORY_FIGURE_LAYOUT)
+                        
+                        # Keep the figure as a Python dict; it is serialized once in the response
+                        fig_dict = fig.to_dict()
+                        graphical_data = {
+                            "data": fig_dict["data"],
+                            "layout": fig_dict["layout"]
+                        }
+
+                        iteration_result = summarize_parking_history(df)
+                    else:
+                        iteration_result = "I couldn't find the parking history data for the station."
+                
+                entries.append(f"In the {iteration + 1} iteration you called {func_name} with {params} parameters, and the function returned {iteration_result}.")
 
         elif response_text.startswith("FINAL_ANSWER:"):
             final_answer = response_text.replace("FINAL_ANSWER:", "").strip()
             execution_time = time.time() - start_time
             logger.info(f"\n[bold]Query completed in {execution_time:.2f}s[/bold]")
-            return {
+            return _json_response({
                 "text_response": final_answer,
                 "graphical_data": graphical_data
-            }
+            })
 
-        iteration_response.append(f"In the {iteration + 1} iteration you called {func_name} with {params} parameters, and the function returned {iteration_result}.")
+        else:
+            entries = [f"In the {iteration + 1} iteration you gave an invalid response: {response_text}"]
+            iteration_result = response_text
+        
+        entry = " ".join(entries)
+        history = f"{history} {entry}" if history else entry
         last_response = iteration_result
         
         iteration += 1
 
     execution_time = time.time() - start_time
     logger.info(f"\n[bold]Query terminated after {execution_time:.2f}s[/bold]")
-    return {
+    return _json_response({
         "text_response": "I couldn't complete the query in the maximum number of iterations.",
         "graphical_data": graphical_data
-    }
+    })
 
 if __name__ == "__main__":
     import uvicorn
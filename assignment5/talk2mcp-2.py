@@ -1,21 +1,75 @@
 import os
+import sys
 from dotenv import load_dotenv
 from mcp import ClientSession, StdioServerParameters, types
 from mcp.client.stdio import stdio_client
 import asyncio
 from google import genai
+from google.genai import errors as genai_errors
+from google.genai import types as genai_types
 from concurrent.futures import TimeoutError
 from functools import partial
 import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import json
+import hashlib
+import orjson
+import random
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Global variables
+# Log through a queue so terminal writes happen on the listener thread started in
+# __main__ instead of blocking the event loop. Set DEBUG to see the system prompt.
+_log_queue = queue.SimpleQueue()
+logger = logging.getLogger("talk2mcp")
+logger.setLevel(logging.INFO)
+logger.addHandler(QueueHandler(_log_queue))
+logger.propagate = False
+
 max_iterations = 10
-last_response = None
-iteration = 0
-iteration_response = []
+LLM_MAX_ATTEMPTS = 3
+
+@dataclass
+class AgentContext:
+    """State of a single agent run, passed explicitly instead of module globals"""
+    last_response: Optional[str] = None
+    iteration: int = 0
+    log: List[str] = field(default_factory=list)
+    # tool_cache_key -> result string, for CACHEABLE_TOOLS only
+    tool_cache: Dict[str, str] = field(default_factory=dict)
+
+# Response types the model may emit, and the legacy FINAL_ANSWER: [value] pattern
+FUNCTION_CALL = "FUNCTION_CALL"
+FINAL_ANSWER = "FINAL_ANSWER"
+ERROR = "ERROR"
+UNCERTAIN = "UNCERTAIN"
+_FINAL_RE = re.compile(r'\[([^\]]*)\]')
+
+# Pure tools whose results can be reused for identical arguments. Tools with
+# side effects (paint, email) must never be added here.
+CACHEABLE_TOOLS = {
+    "add", "add_list", "subtract", "multiply", "divide", "power", "sqrt", "cbrt",
+    "factorial", "log", "remainder", "sin", "cos", "tan", "mine",
+    "strings_to_chars_to_int", "int_list_to_exponential_sum", "fibonacci_numbers"
+}
+
+# GUI tools executed in the background by paint_worker
+PAINT_TOOLS = {"open_paint", "draw_rectangle", "add_text_in_paint"}
+# The paint server (assignment4/server.py) reports failures as ordinary text
+# results starting with one of these
+_PAINT_ERROR_PREFIXES = ("Error drawing", "Error opening", "Error:", "Paint is not open")
+# Seconds to wait for queued paint calls at shutdown before dropping them
+PAINT_DRAIN_TIMEOUT = 30
+
+def tool_cache_key(func_name, arguments):
+    """Stable cache key for a tool call"""
+    payload = json.dumps({"f": func_name, "a": arguments}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
 
 def initialize_environment():
     """Initialize environment and setup Gemini client"""
@@ -26,10 +80,10 @@ def initialize_environment():
 
 async def get_available_tools(session):
     """Fetch and process available tools from MCP"""
-    print("Requesting tool list...")
+    logger.info("Requesting tool list...")
     tools_result = await session.list_tools()
     tools = tools_result.tools
-    print(f"Successfully retrieved {len(tools)} tools")
+    logger.info(f"Successfully retrieved {len(tools)} tools")
     return tools
 
 def format_tool_descriptions(tools):
@@ -52,9 +106,9 @@ def format_tool_descriptions(tools):
 
             tool_desc = f"{i+1}. {name}({params_str}) - {desc}"
             tools_description.append(tool_desc)
-            print(f"Added description for tool: {tool_desc}")
+            logger.info(f"Added description for tool: {tool_desc}")
         except Exception as e:
-            print(f"Error processing tool {i}: {e}")
+            logger.error(f"Error processing tool {i}: {e}")
             tools_description.append(f"{i+1}. Error processing tool")
     
     return "\n".join(tools_description)
@@ -89,7 +143,7 @@ You must respond with EXACTLY ONE line in one of these formats (no additional te
    FUNCTION_CALL: function_name|param1|param2|...
    
 2. For final answers:
-   FINAL_ANSWER: [number]
+   FINAL_ANSWER: {{"value": number}}
 
 3. For error or uncertainty:
    ERROR: [error_type]|[description]
@@ -115,43 +169,52 @@ Examples:
 - FUNCTION_CALL: strings_to_chars_to_int|INDIA
 - FUNCTION_CALL: draw_rectangle|540|700|1080|1440
 - FUNCTION_CALL: add_text_in_paint|Hello
-- FINAL_ANSWER: [42]
+- FINAL_ANSWER: {{"value": 42}}
 - ERROR: INVALID_INPUT|Number too large for calculation
 - UNCERTAIN: AMBIGUOUS_OPERATION|Need clarification on operation order
 
 DO NOT include any explanations or additional text.
 Your entire response should be a single line starting with either FUNCTION_CALL:, FINAL_ANSWER:, ERROR:, or UNCERTAIN:"""
 
-def reset_state():
-    """Reset all global variables to their initial state"""
-    global last_response, iteration, iteration_response
-    last_response = None
-    iteration = 0
-    iteration_response = []
-
-async def generate_with_timeout(client, prompt, timeout=10):
-    """Generate content with a timeout"""
-    print("Starting LLM generation...")
-    try:
-        loop = asyncio.get_event_loop()
-        response = await asyncio.wait_for(
-            loop.run_in_executor(
-                None, 
-                lambda: client.models.generate_content(
+def build_system_part(system_prompt):
+    """Build the system prompt Part once per run"""
+    return genai_types.Part.from_text(text=system_prompt)
+
+def build_contents(system_part, current_query):
+    """Wrap the query as a user turn. The system prompt goes in as its own leading
+    part so the same object is reused every iteration."""
+    return [genai_types.Content(role="user", parts=[system_part, genai_types.Part.from_text(text=f"\n\nQuery: {current_query}")])]
+
+async def generate_with_timeout(client, contents, timeout=10):
+    """Generate content with a timeout, retrying timeouts and transient API errors
+    with jittered exponential backoff. Returns None if every attempt timed out."""
+    logger.info("Starting LLM generation...")
+    for attempt in range(LLM_MAX_ATTEMPTS):
+        last_attempt = attempt == LLM_MAX_ATTEMPTS - 1
+        try:
+            response = await asyncio.wait_for(
+                client.aio.models.generate_content(
                     model="gemini-2.0-flash",
-                    contents=prompt
-                )
-            ),
-            timeout=timeout
-        )
-        print("LLM generation completed")
-        return response
-    except TimeoutError:
-        print("LLM generation timed out!")
-        raise
-    except Exception as e:
-        print(f"Error in LLM generation: {e}")
-        raise
+                    contents=contents
+                ),
+                timeout=timeout
+            )
+            logger.info("LLM generation completed")
+            return response
+        except asyncio.TimeoutError:
+            logger.warning(f"LLM generation timed out! (attempt {attempt + 1}/{LLM_MAX_ATTEMPTS})")
+            if last_attempt:
+                return None
+        except genai_errors.APIError as e:
+            # Retry server errors and rate limiting, anything else is permanent
+            retryable = isinstance(e, genai_errors.ServerError) or e.code == 429
+            logger.error(f"Error in LLM generation (attempt {attempt + 1}/{LLM_MAX_ATTEMPTS}): {e}")
+            if not retryable or last_attempt:
+                raise
+        except Exception as e:
+            logger.error(f"Error in LLM generation: {e}")
+            raise
+        await asyncio.sleep(min(2 ** attempt, 4) + random.random() * 0.25)
 
 def parse_response(response_text):
     """Parse response text into type and content"""
@@ -166,9 +229,9 @@ def parse_response(response_text):
     return response_type.strip(), content.strip()
 
 def parse_function_call(response_text):
-    """Parse function call string into components"""
-    parts = [p.strip() for p in response_text.split("|")]
-    return parts[0], parts[1:]
+    """Parse function call string into components, params are stripped on use"""
+    func_name, _, rest = response_text.partition("|")
+    return func_name.strip(), rest.split("|") if rest else []
 
 def parse_error_uncertain(response_text):
     """Parse error or uncertain response into components"""
@@ -177,30 +240,41 @@ def parse_error_uncertain(response_text):
         return parts[0], ""
     return parts[0].strip(), parts[1].strip()
 
-def prepare_tool_arguments(tool, params):
-    """Convert parameters according to tool schema"""
-    arguments = {}
-    schema_properties = tool.inputSchema.get('properties', {})
-    
-    for param_name, param_info in schema_properties.items():
-        if not params:
-            raise ValueError(f"Not enough parameters provided for {tool.name}")
-            
-        value = params.pop(0)
-        param_type = param_info.get('type', 'string')
-        
-        if param_type == 'integer':
-            arguments[param_name] = int(value)
-        elif param_type == 'number':
-            arguments[param_name] = float(value)
-        elif param_type == 'array':
-            if isinstance(value, str):
-                value = value.strip('[]').split(',')
-            arguments[param_name] = [int(x.strip()) for x in value]
-        else:
-            arguments[param_name] = str(value)
-    
-    return arguments
+def _parse_array(value):
+    """Convert a "[1, 2, 3]" string (or list) into a list of ints"""
+    if isinstance(value, str):
+        value = value.strip('[]').split(',')
+    return [int(x.strip()) for x in value]
+
+# JSON schema type -> converter for the string parameters parsed from the LLM
+_CONVERTERS = {
+    'integer': int,
+    'number': float,
+    'array': _parse_array,
+    'string': str
+}
+
+def build_tool_converters(tools):
+    """Precompute (param_name, converter) pairs from each tool's input schema.
+    This is the only place the schema is read; tool calls use the cached pairs."""
+    return {
+        tool.name: [
+            (param_name, _CONVERTERS.get(param_info.get('type', 'string'), str))
+            for param_name, param_info in (tool.inputSchema.get('properties') or {}).items()
+        ]
+        for tool in tools
+    }
+
+def prepare_tool_arguments(tool, params, converters):
+    """Convert parameters using the tool's precomputed converters"""
+    if len(params) < len(converters):
+        raise ValueError(f"Not enough parameters provided for {tool.name}")
+    return {param_name: convert(value.strip()) for (param_name, convert), value in zip(converters, params)}
+
+def _content_text(item):
+    """Text of a tool result content item, falling back to its string form"""
+    text = getattr(item, 'text', None)
+    return text if text is not None else str(item)
 
 async def execute_tool(session, func_name, arguments):
     """Execute tool and handle results"""
@@ -208,30 +282,48 @@ async def execute_tool(session, func_name, arguments):
     
     if hasattr(result, 'content'):
         if isinstance(result.content, list):
-            return [item.text if hasattr(item, 'text') else str(item) for item in result.content]
+            # Format the content items straight into the "[a, b]" result string
+            return "[" + ", ".join(_content_text(item) for item in result.content) + "]"
         return str(result.content)
     return str(result)
 
-def format_tool_result(result):
-    """Format tool execution results"""
-    if isinstance(result, list):
-        return f"[{', '.join(result)}]"
-    return str(result)
+async def paint_worker(ctx, session, paint_queue):
+    """Execute queued paint tool calls one at a time, in order. The LLM was told
+    each call was queued, so failures are added to ctx.log for the next prompt."""
+    while True:
+        func_name, arguments = await paint_queue.get()
+        try:
+            result = await execute_tool(session, func_name, arguments)
+            # execute_tool wraps content lists as "[text, ...]"
+            if result.lstrip("[").startswith(_PAINT_ERROR_PREFIXES):
+                logger.error(f"Error executing {func_name}: {result}")
+                ctx.log.append(f"Error executing {func_name}: {result}")
+            else:
+                logger.info(f"Paint tool {func_name} returned {result}")
+        except Exception as e:
+            logger.error(f"Error executing {func_name}: {e}")
+            ctx.log.append(f"Error executing {func_name}: {e}")
+        finally:
+            paint_queue.task_done()
 
-async def handle_final_answer(session, response_text):
+async def handle_final_answer(response_text):
     """Handle final answer with validation"""
     try:
-        # Extract the number from FINAL_ANSWER: [number]
-        match = re.search(r'\[(.*?)\]', response_text)
-        if not match:
-            print("Invalid FINAL_ANSWER format: No brackets found")
-            return
-        
-        number = match.group(1).strip()
+        # Extract the value from FINAL_ANSWER: {"value": number}
+        body = response_text.partition(":")[2].strip()
+        try:
+            number = str(orjson.loads(body)["value"]).strip()
+        except (orjson.JSONDecodeError, TypeError, KeyError):
+            # Fall back to the bracketed FINAL_ANSWER: [number] format
+            match = _FINAL_RE.search(response_text)
+            if not match:
+                logger.warning("Invalid FINAL_ANSWER format: expected {\"value\": ...}")
+                return
+            number = match.group(1).strip()
         
         # Basic validation
         if not number:
-            print("Invalid FINAL_ANSWER: Empty result")
+            logger.warning("Invalid FINAL_ANSWER: Empty result")
             return
             
         try:
@@ -240,159 +332,204 @@ async def handle_final_answer(session, response_text):
         except ValueError:
             # If not a number, verify it's not empty or just whitespace
             if not number.strip():
-                print("Invalid FINAL_ANSWER: Empty or whitespace")
+                logger.warning("Invalid FINAL_ANSWER: Empty or whitespace")
                 return
         
-        print(f"Final answer validated: [{number}]")
+        logger.info(f"Final answer validated: [{number}]")
         
     except Exception as e:
-        print(f"Error processing final answer: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error processing final answer: {e}")
 
 async def handle_error(error_type, description):
     """Handle error responses"""
-    print(f"\nError encountered: {error_type}")
-    print(f"Description: {description}")
+    logger.warning(f"Error encountered: {error_type}")
+    logger.warning(f"Description: {description}")
     return False  # Changed to False to continue iterations after error
 
 async def handle_uncertain(reason, next_steps):
     """Handle uncertainty in responses"""
-    print(f"\nUncertainty reported: {reason}")
-    print(f"Suggested next steps: {next_steps}")
+    logger.warning(f"Uncertainty reported: {reason}")
+    logger.warning(f"Suggested next steps: {next_steps}")
     return False  # Continue iterations
 
-async def run_iteration(session, tools, current_query, system_prompt, client):
+async def run_iteration(ctx, session, tools_by_name, tool_converters, current_query, system_part, client, paint_queue=None):
     """Handle single iteration of the problem-solving process"""
-    global iteration, last_response, iteration_response
-    
-    print(f"\n--- Iteration {iteration + 1} ---")
-    prompt = f"{system_prompt}\n\nQuery: {current_query}"
+    log = ctx.log  # bound once, used on every path below
+    logger.info(f"--- Iteration {ctx.iteration + 1} ---")
+    contents = build_contents(system_part, current_query)
     
     try:
-        response = await generate_with_timeout(client, prompt)
+        response = await generate_with_timeout(client, contents)
+        if response is None:
+            # Keep the accumulated state and move on to the next iteration
+            log.append("Error: LLM generation timed out")
+            return await handle_error("LLM_TIMEOUT", "LLM generation timed out")
         response_text = response.text.strip()
-        print(f"LLM Response: {response_text}")
+        logger.info(f"LLM Response: {response_text}")
         
         # Parse the response
         response_type, content = parse_response(response_text)
         
-        if response_type == "FUNCTION_CALL":
+        if response_type == FUNCTION_CALL:
             func_name, params = parse_function_call(content)
             
             # Find the matching tool
-            tool = next((t for t in tools if t.name == func_name), None)
+            tool = tools_by_name.get(func_name)
             if not tool:
-                iteration_response.append(f"Error: Tool not found: {func_name}")
+                log.append(f"Error: Tool not found: {func_name}")
                 return await handle_error("UNKNOWN_TOOL", f"Tool not found: {func_name}")
             
             try:
                 # Execute the tool
-                arguments = prepare_tool_arguments(tool, params)
-                result = await execute_tool(session, func_name, arguments)
-                result_str = format_tool_result(result)
+                arguments = prepare_tool_arguments(tool, params, tool_converters[func_name])
+                cache_key = tool_cache_key(func_name, arguments) if func_name in CACHEABLE_TOOLS else None
+                if paint_queue is not None and func_name in PAINT_TOOLS:
+                    # Hand off to the paint worker and let the LLM carry on
+                    paint_queue.put_nowait((func_name, arguments))
+                    result_str = f"[{func_name} queued successfully]"
+                elif cache_key is not None and cache_key in ctx.tool_cache:
+                    logger.info(f"Using cached result for {func_name}")
+                    result_str = ctx.tool_cache[cache_key]
+                else:
+                    result_str = await execute_tool(session, func_name, arguments)
+                    if cache_key is not None and result_str:
+                        ctx.tool_cache[cache_key] = result_str
                 
                 # Validate result
                 if result_str is None or result_str == "":
-                    iteration_response.append(f"Error: Empty result from {func_name}")
+                    log.append(f"Error: Empty result from {func_name}")
                     return await handle_error("INVALID_RESULT", f"Empty result from {func_name}")
                 
                 # Update iteration state
-                iteration_response.append(
-                    f"In the {iteration + 1} iteration you called {func_name} with {arguments} parameters, "
+                log.append(
+                    f"In the {ctx.iteration + 1} iteration you called {func_name} with {arguments} parameters, "
                     f"and the function returned {result_str}."
                 )
-                last_response = result_str
+                ctx.last_response = result_str
                 return False  # Continue iterations
             
             except Exception as e:
-                iteration_response.append(f"Error executing {func_name}: {str(e)}")
+                log.append(f"Error executing {func_name}: {str(e)}")
                 return await handle_error("TOOL_EXECUTION_ERROR", str(e))
             
-        elif response_type == "FINAL_ANSWER":
-            await handle_final_answer(session, response_text)
+        elif response_type == FINAL_ANSWER:
+            await handle_final_answer(response_text)
             return True  # Stop iterations only on final answer
             
-        elif response_type == "ERROR":
+        elif response_type == ERROR:
             error_type, description = parse_error_uncertain(content)
-            iteration_response.append(f"Error reported: {error_type} - {description}")
+            log.append(f"Error reported: {error_type} - {description}")
             return await handle_error(error_type, description)
             
-        elif response_type == "UNCERTAIN":
+        elif response_type == UNCERTAIN:
             reason, next_steps = parse_error_uncertain(content)
-            iteration_response.append(f"Uncertainty reported: {reason} - Next steps: {next_steps}")
+            log.append(f"Uncertainty reported: {reason} - Next steps: {next_steps}")
             return await handle_uncertain(reason, next_steps)
             
         else:
-            iteration_response.append(f"Invalid response type: {response_type}")
+            log.append(f"Invalid response type: {response_type}")
             return await handle_error("INVALID_RESPONSE_TYPE", f"Unknown response type: {response_type}")
             
     except Exception as e:
-        print(f"Error in iteration: {e}")
-        import traceback
-        traceback.print_exc()
-        iteration_response.append(f"Iteration error: {str(e)}")
+        logger.exception(f"Error in iteration: {e}")
+        log.append(f"Iteration error: {str(e)}")
         return await handle_error("ITERATION_ERROR", str(e))
 
 async def main():
-    global last_response, iteration, iteration_response
-    reset_state()
+    ctx = AgentContext()
+    # Printed directly: the listener thread could otherwise write it after the input() prompt
     print("Starting main execution...")
     
     try:
         # Get user query
         # Find the ASCII values of characters in INDIA and then return sum of exponentials of those values. 
         query = input("Please enter your query: ")
-        print("\nProcessing your query...")
+        logger.info("Processing your query...")
         
         # Initialize environment
         client = initialize_environment()
         
         # Create MCP connection
-        print("Establishing connection to MCP server...")
+        logger.info("Establishing connection to MCP server...")
         server_params = StdioServerParameters(
             command="python",
             args=["assignment4/server.py"]
         )
         
         async with stdio_client(server_params) as (read, write):
-            print("Connection established, creating session...")
+            logger.info("Connection established, creating session...")
             async with ClientSession(read, write) as session:
-                print("Session created, initializing...")
+                logger.info("Session created, initializing...")
                 await session.initialize()
                 
                 # Get and process tools
                 tools = await get_available_tools(session)
-                tools_description = format_tool_descriptions(tools)
-                system_prompt = create_system_prompt(tools_description)
+                # Build the prompt once; the tool descriptions are only needed inside it
+                system_prompt = create_system_prompt(format_tool_descriptions(tools))
+
+                logger.debug(system_prompt)
 
-                print(system_prompt)
+                # Constant for the whole session, so build them once
+                system_part = build_system_part(system_prompt)
+                tools_by_name = {t.name: t for t in tools}
+                tool_converters = build_tool_converters(tools)
                 
-                # Main iteration loop
-                while iteration < max_iterations:
-                    if last_response is None:
-                        current_query = query
-                    else:
-                        current_query = query + "\n\n" + " ".join(iteration_response)
-                        current_query = current_query + "  What should I do next?"
-                    
-                    # Run iteration
-                    should_stop = await run_iteration(session, tools, current_query, system_prompt, client)
-                    if should_stop:
-                        break
-                    
-                    iteration += 1
-                    
-                    # Wait for user input before next iteration
-                    # if iteration < max_iterations:
-                    #     input("\nPress Enter to continue to next iteration...")
+                # Running log of ctx.log entries, extended with new entries only
+                history = ""
+                history_count = 0
+
+                # Paint tools run in order on a background worker so the next
+                # LLM generation can start while the GUI is being driven
+                paint_queue = asyncio.Queue()
+                paint_task = asyncio.create_task(paint_worker(ctx, session, paint_queue))
+
+                try:
+                    # Main iteration loop
+                    while ctx.iteration < max_iterations:
+                        if history_count < len(ctx.log):
+                            new_entries = " ".join(ctx.log[history_count:])
+                            history = f"{history} {new_entries}" if history else new_entries
+                            history_count = len(ctx.log)
+
+                        if ctx.last_response is None:
+                            current_query = query
+                        else:
+                            current_query = f"{query}\n\n{history}  What should I do next?"
+
+                        # Run iteration
+                        should_stop = await run_iteration(ctx, session, tools_by_name, tool_converters, current_query, system_part, client, paint_queue)
+                        if should_stop:
+                            break
+
+                        ctx.iteration += 1
+
+                        # Wait for user input before next iteration
+                        # if iteration < max_iterations:
+                        #     input("\nPress Enter to continue to next iteration...")
+                finally:
+                    # Let queued paint calls finish before the session closes, unless
+                    # the worker is gone or the GUI stopped responding
+                    if not paint_task.done():
+                        try:
+                            await asyncio.wait_for(paint_queue.join(), PAINT_DRAIN_TIMEOUT)
+                        except asyncio.TimeoutError:
+                            logger.warning(f"Dropped {paint_queue.qsize()} queued paint calls at shutdown")
+                    paint_task.cancel()
+                    await asyncio.gather(paint_task, return_exceptions=True)
     
     except Exception as e:
-        print(f"Error in main execution: {e}")
-        import traceback
-        traceback.print_exc()
-    finally:
-        reset_state()
+        logger.exception(f"Error in main execution: {e}")
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    # uvloop is optional (and unavailable on Windows), fall back to the stock loop
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    listener = QueueListener(_log_queue, logging.StreamHandler(sys.stdout))
+    listener.start()
+    try:
+        asyncio.run(main())
+    finally:
+        listener.stop()
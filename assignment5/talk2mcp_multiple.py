@@ -1,36 +1,81 @@
 import os
+import sys
 from dotenv import load_dotenv
 from mcp import ClientSession, StdioServerParameters, types
 from mcp.client.stdio import stdio_client
 import asyncio
 from google import genai
+from google.genai import errors as genai_errors
+from google.genai import types as genai_types
 from concurrent.futures import TimeoutError
 from functools import partial
 import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+import json
+import hashlib
+import random
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Global variables
+# Log through a queue so terminal writes happen on the listener thread started in
+# __main__ instead of blocking the event loop. Set DEBUG to see the system prompt.
+_log_queue = queue.SimpleQueue()
+logger = logging.getLogger("talk2mcp_multiple")
+logger.setLevel(logging.INFO)
+logger.addHandler(QueueHandler(_log_queue))
+logger.propagate = False
+
 max_iterations = 10
-last_response = None
-iteration = 0
-iteration_response = []
-servers = {
+LLM_MAX_ATTEMPTS = 3
+
+# Static launch settings; each run keeps its sessions and tools in AgentContext.servers
+SERVER_CONFIGS = {
     'math': {
         'command': 'python',
-        'args': ['assignment4/server.py'],
-        'session': None,
-        'tools': []
+        'args': ['assignment4/server.py']
     },
     'gmail': {
         'command': 'python',
-        'args': ['assignment4/gmail_server.py', '--creds-file-path', os.getenv("CREDS_FILE_PATH"), '--token-path', os.getenv("TOKEN_PATH")],
-        'session': None,
-        'tools': []
+        'args': ['assignment4/gmail_server.py', '--creds-file-path', os.getenv("CREDS_FILE_PATH"), '--token-path', os.getenv("TOKEN_PATH")]
     }
 }
 
+@dataclass
+class AgentContext:
+    """State of a single agent run, passed explicitly instead of module globals"""
+    last_response: Optional[str] = None
+    iteration: int = 0
+    log: List[str] = field(default_factory=list)
+    # server name -> {'command', 'args', 'session', 'tools'}, filled in by serve_session
+    servers: Dict[str, dict] = field(default_factory=lambda: {
+        name: {**config, 'session': None, 'tools': []} for name, config in SERVER_CONFIGS.items()
+    })
+    # tool_cache_key -> result string, for CACHEABLE_TOOLS only
+    tool_cache: Dict[str, str] = field(default_factory=dict)
+
+# Pure tools whose results can be reused for identical arguments. Tools with
+# side effects (paint, email) must never be added here.
+CACHEABLE_TOOLS = {
+    "add", "add_list", "subtract", "multiply", "divide", "power", "sqrt", "cbrt",
+    "factorial", "log", "remainder", "sin", "cos", "tan", "mine",
+    "strings_to_chars_to_int", "int_list_to_exponential_sum", "fibonacci_numbers"
+}
+
+# Response prefixes and the FINAL_ANSWER: [value] pattern
+_FC_PREFIX = "FUNCTION_CALL:"
+_FA_PREFIX = "FINAL_ANSWER:"
+_FINAL_ANSWER_RE = re.compile(r'\[([^\]]*)\]')
+
+def tool_cache_key(func_name, arguments):
+    """Stable cache key for a tool call"""
+    payload = json.dumps({"f": func_name, "a": arguments}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
 def initialize_environment():
     """Initialize environment and setup Gemini client"""
     api_key = os.getenv("GEMINI_API_KEY")
@@ -40,10 +85,10 @@ def initialize_environment():
 
 async def get_available_tools(session):
     """Fetch and process available tools from MCP"""
-    print("Requesting tool list...")
+    logger.info("Requesting tool list...")
     tools_result = await session.list_tools()
     tools = tools_result.tools
-    print(f"Successfully retrieved {len(tools)} tools")
+    logger.info(f"Successfully retrieved {len(tools)} tools")
     return tools
 
 def format_tool_descriptions(tools_list):
@@ -70,9 +115,9 @@ def format_tool_descriptions(tools_list):
 
                 tool_desc = f"{tool_index+1}. {name}({params_str}) - {desc} [Server: {server_name}]"
                 tools_description.append(tool_desc)
-                print(f"Added description for tool: {tool_desc}")
+                logger.info(f"Added description for tool: {tool_desc}")
             except Exception as e:
-                print(f"Error processing tool {tool_index}: {e}")
+                logger.error(f"Error processing tool {tool_index}: {e}")
                 tools_description.append(f"{tool_index+1}. Error processing tool")
             tool_index += 1
     
@@ -96,9 +141,10 @@ When you want to send a mail use the following steps:-
 Available tools:
 {tools_description}
 
-You must respond with EXACTLY ONE line in one of these formats (no additional text):
+You must respond only with lines in one of these formats (no additional text):
 1. For function calls:
    FUNCTION_CALL: function_name|param1|param2|...
+   You may give several independent function calls, one FUNCTION_CALL per line.
    
 2. For final answers:
    FINAL_ANSWER: [number]
@@ -117,249 +163,362 @@ Examples:
 - FINAL_ANSWER: [42]
 
 DO NOT include any explanations or additional text.
-Your entire response should be a single line starting with either FUNCTION_CALL: or FINAL_ANSWER:"""
-
-def reset_state():
-    """Reset all global variables to their initial state"""
-    global last_response, iteration, iteration_response
-    last_response = None
-    iteration = 0
-    iteration_response = []
-
-async def generate_with_timeout(client, prompt, timeout=10):
-    """Generate content with a timeout"""
-    print("Starting LLM generation...")
-    try:
-        loop = asyncio.get_event_loop()
-        response = await asyncio.wait_for(
-            loop.run_in_executor(
-                None, 
-                lambda: client.models.generate_content(
+Every line of your response should start with FUNCTION_CALL:, or your response should be a single line starting with FINAL_ANSWER:"""
+
+def build_system_part(system_prompt):
+    """Build the system prompt Part once per run"""
+    return genai_types.Part.from_text(text=system_prompt)
+
+def build_contents(system_part, current_query):
+    """Wrap the query as a user turn. The system prompt goes in as its own leading
+    part so the same object is reused every iteration."""
+    return [genai_types.Content(role="user", parts=[system_part, genai_types.Part.from_text(text=f"\n\nQuery: {current_query}")])]
+
+async def generate_with_timeout(client, contents, timeout=10):
+    """Generate content with a timeout, retrying timeouts and transient API errors
+    with jittered exponential backoff. Returns None if every attempt timed out."""
+    logger.info("Starting LLM generation...")
+    for attempt in range(LLM_MAX_ATTEMPTS):
+        last_attempt = attempt == LLM_MAX_ATTEMPTS - 1
+        try:
+            response = await asyncio.wait_for(
+                client.aio.models.generate_content(
                     model="gemini-2.0-flash",
-                    contents=prompt
-                )
-            ),
-            timeout=timeout
-        )
-        print("LLM generation completed")
-        return response
-    except TimeoutError:
-        print("LLM generation timed out!")
-        raise
-    except Exception as e:
-        print(f"Error in LLM generation: {e}")
-        raise
-
-def parse_function_call(response_text):
-    """Parse function call string into components"""
-    _, function_info = response_text.split(":", 1)
-    parts = [p.strip() for p in function_info.split("|")]
-    return parts[0], parts[1:]
-
-def prepare_tool_arguments(tool, params):
-    """Convert parameters according to tool schema"""
-    arguments = {}
-    schema_properties = tool.inputSchema.get('properties', {})
-    
-    for param_name, param_info in schema_properties.items():
-        if not params:
-            raise ValueError(f"Not enough parameters provided for {tool.name}")
-            
-        value = params.pop(0)
-        param_type = param_info.get('type', 'string')
-        
-        if param_type == 'integer':
-            arguments[param_name] = int(value)
-        elif param_type == 'number':
-            arguments[param_name] = float(value)
-        elif param_type == 'array':
-            if isinstance(value, str):
-                value = value.strip('[]').split(',')
-            arguments[param_name] = [int(x.strip()) for x in value]
-        else:
-            arguments[param_name] = str(value)
-    
-    return arguments
-
-async def execute_tool(server_name, func_name, arguments):
-    """Execute tool on a specific server"""
-    server_data = servers[server_name]
-    server_params = StdioServerParameters(
-        command=server_data['command'],
-        args=server_data['args']
-    )
+                    contents=contents
+                ),
+                timeout=timeout
+            )
+            logger.info("LLM generation completed")
+            return response
+        except asyncio.TimeoutError:
+            logger.warning(f"LLM generation timed out! (attempt {attempt + 1}/{LLM_MAX_ATTEMPTS})")
+            if last_attempt:
+                return None
+        except genai_errors.APIError as e:
+            # Retry server errors and rate limiting, anything else is permanent
+            retryable = isinstance(e, genai_errors.ServerError) or e.code == 429
+            logger.error(f"Error in LLM generation (attempt {attempt + 1}/{LLM_MAX_ATTEMPTS}): {e}")
+            if not retryable or last_attempt:
+                raise
+        except Exception as e:
+            logger.error(f"Error in LLM generation: {e}")
+            raise
+        await asyncio.sleep(min(2 ** attempt, 4) + random.random() * 0.25)
+
+def parse_response(response_text):
+    """
+    Scan the response once, collecting every FUNCTION_CALL: line.
+    Returns (_FC_PREFIX, [(func_name, params), ...]), (_FA_PREFIX, []) for a final
+    answer, or (None, []) when neither is present.
+    """
+    calls = []
+    start = 0
+    length = len(response_text)
+    while start <= length:
+        end = response_text.find('\n', start)
+        if end == -1:
+            end = length
+        line = response_text[start:end].strip()
+        if line.startswith(_FC_PREFIX):
+            func_name, *params = line[len(_FC_PREFIX):].split("|")
+            calls.append((func_name.strip(), [p.strip() for p in params]))
+        start = end + 1
     
-    print(f"Executing {func_name} on {server_name} server...")
-    async with stdio_client(server_params) as (read, write):
-        async with ClientSession(read, write) as session:
-            await session.initialize()
-            
-            result = await session.call_tool(func_name, arguments=arguments)
-            if hasattr(result, 'content'):
-                if isinstance(result.content, list):
-                    return [item.text if hasattr(item, 'text') else str(item) for item in result.content]
-                return str(result.content)
-            return str(result)
-
-async def get_server_tools(server_name):
-    """Get tools from a specific server"""
-    server_data = servers[server_name]
-    server_params = StdioServerParameters(
-        command=server_data['command'],
-        args=server_data['args']
-    )
+    if calls:
+        return _FC_PREFIX, calls
+    if response_text.startswith(_FA_PREFIX):
+        return _FA_PREFIX, []
+    return None, []
+
+def _parse_array(value):
+    """Convert a "[1, 2, 3]" string (or list) into a list of ints"""
+    if isinstance(value, str):
+        value = value.strip('[]').split(',')
+    return [int(x.strip()) for x in value]
+
+# JSON schema type -> converter for the string parameters parsed from the LLM
+_CONVERTERS = {
+    'integer': int,
+    'number': float,
+    'array': _parse_array,
+    'string': str
+}
+
+def build_tool_converters(tools_list):
+    """Precompute (param_name, converter) pairs from the input schema of every server's tools.
+    This is the only place the schema is read; tool calls use the cached pairs."""
+    return {
+        tool.name: [
+            (param_name, _CONVERTERS.get(param_info.get('type', 'string'), str))
+            for param_name, param_info in (tool.inputSchema.get('properties') or {}).items()
+        ]
+        for server_data in tools_list.values()
+        for tool in server_data['tools']
+    }
+
+def prepare_tool_arguments(tool, params, converters):
+    """Convert parameters using the tool's precomputed converters"""
+    if len(params) < len(converters):
+        raise ValueError(f"Not enough parameters provided for {tool.name}")
+    return {param_name: convert(value) for (param_name, convert), value in zip(converters, params)}
+
+def _content_text(item):
+    """Text of a tool result content item, falling back to its string form"""
+    text = getattr(item, 'text', None)
+    return text if text is not None else str(item)
+
+async def execute_tool(ctx, server_name, func_name, arguments):
+    """Execute tool on a specific server using its persistent session"""
+    session = ctx.servers[server_name]['session']
+    if session is None:
+        raise ValueError(f"No active session for {server_name} server")
     
-    print(f"Connecting to {server_name} server...")
-    async with stdio_client(server_params) as (read, write):
-        print(f"Connection established to {server_name}, creating session...")
-        async with ClientSession(read, write) as session:
-            print(f"Session created for {server_name}, initializing...")
-            await session.initialize()
-            
-            # Get and process tools
-            tools = await get_available_tools(session)
-            print(f"Successfully retrieved {len(tools)} tools from {server_name} server")
-            return tools
-
-def format_tool_result(result):
-    """Format tool execution results"""
-    if isinstance(result, list):
-        return f"[{', '.join(result)}]"
+    logger.info(f"Executing {func_name} on {server_name} server...")
+    result = await session.call_tool(func_name, arguments=arguments)
+    if hasattr(result, 'content'):
+        if isinstance(result.content, list):
+            # Format the content items straight into the "[a, b]" result string
+            return "[" + ", ".join(_content_text(item) for item in result.content) + "]"
+        return str(result.content)
     return str(result)
 
+async def serve_session(ctx, server_name, ready, stop):
+    """Keep a session to a server open until stop is set, publishing it and its tools in ctx.servers"""
+    server_data = None
+    # The stdio transport must be entered and exited in the same task, so each
+    # server gets its own long-lived task instead of an exit stack in main
+    try:
+        server_data = ctx.servers[server_name]
+        # e.g. fails when CREDS_FILE_PATH / TOKEN_PATH are unset and args holds None
+        server_params = StdioServerParameters(
+            command=server_data['command'],
+            args=server_data['args']
+        )
+        logger.info(f"Connecting to {server_name} server...")
+        async with stdio_client(server_params) as (read, write):
+            logger.info(f"Connection established to {server_name}, creating session...")
+            async with ClientSession(read, write) as session:
+                logger.info(f"Session created for {server_name}, initializing...")
+                await session.initialize()
+                
+                # Get and process tools
+                tools = await get_available_tools(session)
+                logger.info(f"Successfully retrieved {len(tools)} tools from {server_name} server")
+                server_data['tools'] = tools
+                server_data['session'] = session
+                ready.set()
+                await stop.wait()
+    finally:
+        if server_data is not None:
+            server_data['session'] = None
+        ready.set()
+
+async def wait_until_ready(task, ready):
+    """Wait until a serve_session task has published its session, or has finished early"""
+    ready_wait = asyncio.create_task(ready.wait())
+    try:
+        await asyncio.wait({task, ready_wait}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        ready_wait.cancel()
+
 async def handle_final_answer(response_text):
     """Handle final answer"""
     # Extract the number from FINAL_ANSWER: [number]
     if isinstance(response_text, str):
-        if response_text.startswith("FINAL_ANSWER:"):
+        if response_text.startswith(_FA_PREFIX):
             # Extract the number between square brackets
-            match = re.search(r'\[(.*?)\]', response_text)
+            match = _FINAL_ANSWER_RE.search(response_text)
             if match:
                 number = match.group(1)
-                print(f"Final answer: {number}")
+                logger.info(f"Final answer: {number}")
             else:
-                print("No number found in FINAL_ANSWER")
+                logger.warning("No number found in FINAL_ANSWER")
         else:
-            print("Invalid FINAL_ANSWER format")
+            logger.warning("Invalid FINAL_ANSWER format")
     else:
-        print(response_text.content[0].text)
+        logger.info(response_text.content[0].text)
 
-def find_tool_server(func_name):
-    """Find which server contains the requested tool"""
-    for server_name, server_data in servers.items():
-        for tool in server_data['tools']:
-            if tool.name == func_name:
-                return server_name
-    return None
+def build_tool_index(tools_list):
+    """Map each tool name to the server that provides it and the tool itself"""
+    return {
+        tool.name: (server_name, tool)
+        for server_name, server_data in tools_list.items()
+        for tool in server_data['tools']
+    }
 
-async def run_iteration(tools_list, current_query, system_prompt, client):
-    """Handle single iteration of the problem-solving process"""
-    global iteration, last_response, iteration_response
+async def run_tool_call(ctx, tool_index, tool_converters, func_name, params):
+    """Resolve and execute one tool call, returning (func_name, arguments, result_str)"""
+    # Find the server that has this tool
+    try:
+        server_name, tool = tool_index[func_name]
+    except KeyError:
+        raise ValueError(f"Unknown tool: {func_name}")
+    
+    # Execute the tool
+    arguments = prepare_tool_arguments(tool, params, tool_converters[func_name])
+    cache_key = tool_cache_key(func_name, arguments) if func_name in CACHEABLE_TOOLS else None
+    if cache_key is not None and cache_key in ctx.tool_cache:
+        logger.info(f"Using cached result for {func_name}")
+        result_str = ctx.tool_cache[cache_key]
+    else:
+        result_str = await execute_tool(ctx, server_name, func_name, arguments)
+        if cache_key is not None:
+            ctx.tool_cache[cache_key] = result_str
+    return func_name, arguments, result_str
+
+async def run_tool_calls(ctx, tool_index, tool_converters, calls):
+    """
+    Execute calls to different servers concurrently. Calls to the same server run
+    in the order given, since steps like add_text_in_paint -> draw_rectangle depend
+    on each other. Results are returned in the order of calls; a call that fails is
+    returned as (func_name, None, exception) so the rest of the batch still runs and
+    every call has finished before this returns.
+    """
+    by_server = {}
+    for position, (func_name, params) in enumerate(calls):
+        server_name = tool_index[func_name][0] if func_name in tool_index else None
+        by_server.setdefault(server_name, []).append((position, func_name, params))
     
-    print(f"\n--- Iteration {iteration + 1} ---")
-    prompt = f"{system_prompt}\n\nQuery: {current_query}"
+    results = [None] * len(calls)
+    
+    async def run_server_calls(server_calls):
+        for position, func_name, params in server_calls:
+            try:
+                results[position] = await run_tool_call(ctx, tool_index, tool_converters, func_name, params)
+            except Exception as e:
+                logger.error(f"Error executing {func_name}: {e}")
+                results[position] = (func_name, None, e)
+    
+    await asyncio.gather(*(run_server_calls(server_calls) for server_calls in by_server.values()))
+    return results
+
+async def run_iteration(ctx, tool_index, tool_converters, current_query, system_part, client):
+    """Handle single iteration of the problem-solving process"""
+    log = ctx.log  # bound once, used on every path below
+    logger.info(f"--- Iteration {ctx.iteration + 1} ---")
+    contents = build_contents(system_part, current_query)
     
     try:
-        response = await generate_with_timeout(client, prompt)
+        response = await generate_with_timeout(client, contents)
+        if response is None:
+            # Keep the accumulated state and move on to the next iteration
+            log.append(f"Error in iteration {ctx.iteration + 1}: LLM generation timed out")
+            return False
         response_text = response.text.strip()
-        print(f"LLM Response: {response_text}")
+        logger.info(f"LLM Response: {response_text}")
         
-        # Find the FUNCTION_CALL line in the response
-        for line in response_text.split('\n'):
-            line = line.strip()
-            if line.startswith("FUNCTION_CALL:"):
-                response_text = line
-                break
+        # Find the FUNCTION_CALL lines in the response
+        response_type, calls = parse_response(response_text)
         
-        if response_text.startswith("FUNCTION_CALL:"):
-            func_name, params = parse_function_call(response_text)
-            
-            # Find the server that has this tool
-            server_name = find_tool_server(func_name)
-            if not server_name:
-                raise ValueError(f"Unknown tool: {func_name}")
-            
-            # Find the matching tool
-            tool = next((t for t in tools_list[server_name]['tools'] if t.name == func_name), None)
-            if not tool:
-                raise ValueError(f"Tool {func_name} not found in server {server_name}")
-            
-            # Execute the tool
-            arguments = prepare_tool_arguments(tool, params)
-            result = await execute_tool(server_name, func_name, arguments)
-            result_str = format_tool_result(result)
+        if response_type == _FC_PREFIX:
+            results = await run_tool_calls(ctx, tool_index, tool_converters, calls)
             
-            # Update iteration state
-            iteration_response.append(
-                f"In the {iteration + 1} iteration you called {func_name} with {arguments} parameters, "
-                f"and the function returned {result_str}."
-            )
-            last_response = result_str
-            return False  # Continue iterations
+            # Update iteration state, one entry per call whether it succeeded or not
+            failed = False
+            for func_name, arguments, result_str in results:
+                if isinstance(result_str, Exception):
+                    log.append(f"Error in iteration {ctx.iteration + 1}: Error executing {func_name}: {result_str}")
+                    failed = True
+                    continue
+                log.append(
+                    f"In the {ctx.iteration + 1} iteration you called {func_name} with {arguments} parameters, "
+                    f"and the function returned {result_str}."
+                )
+                ctx.last_response = result_str
+            return failed  # Stop iterations on error, as for a single failing call
             
-        elif response_text.startswith("FINAL_ANSWER:"):
+        elif response_type == _FA_PREFIX:
             await handle_final_answer(response_text)
             return True  # Stop iterations
             
     except Exception as e:
-        print(f"Error in iteration: {e}")
-        import traceback
-        traceback.print_exc()
-        iteration_response.append(f"Error in iteration {iteration + 1}: {str(e)}")
+        logger.exception(f"Error in iteration: {e}")
+        log.append(f"Error in iteration {ctx.iteration + 1}: {str(e)}")
         return True  # Stop iterations on error
 
 async def main():
-    global last_response, iteration, iteration_response
-    reset_state()
+    ctx = AgentContext()
+    # Printed directly: the listener thread could otherwise write it after the input() prompt
     print("Starting main execution...")
+    stop_servers = asyncio.Event()
+    server_tasks = {}
     
     try:
         # Get user query
         query = input("Please enter your query: ")
-        print("\nProcessing your query...")
+        logger.info("Processing your query...")
         
         # Initialize environment
         client = initialize_environment()
         
         # Get tools from all servers
-        print("Fetching tools from all servers...")
-        for server_name in servers:
-            print(f"Getting tools from {server_name} server...")
-            tools = await get_server_tools(server_name)
-            servers[server_name]['tools'] = tools
+        logger.info("Fetching tools from all servers...")
+        # Start all servers concurrently so setup takes max(server) instead of sum(server)
+        ready = {server_name: asyncio.Event() for server_name in ctx.servers}
+        server_tasks = {
+            server_name: asyncio.create_task(serve_session(ctx, server_name, ready[server_name], stop_servers))
+            for server_name in ctx.servers
+        }
+        await asyncio.gather(*(wait_until_ready(task, ready[server_name]) for server_name, task in server_tasks.items()))
+        for server_name, task in server_tasks.items():
+            if task.done() and task.exception() is not None:
+                logger.error(f"Error getting tools from {server_name} server: {task.exception()}")
         
-        # Format all tools from both servers
-        tools_description = format_tool_descriptions(servers)
-        system_prompt = create_system_prompt(tools_description)
+        # Format all tools from both servers into the prompt, built once per run
+        system_prompt = create_system_prompt(format_tool_descriptions(ctx.servers))
 
-        print(system_prompt)
+        logger.debug(system_prompt)
+        system_part = build_system_part(system_prompt)
+        tool_converters = build_tool_converters(ctx.servers)
+        tool_index = build_tool_index(ctx.servers)
+        
+        # Running log of ctx.log entries, extended with new entries only
+        history = ""
+        history_count = 0
         
         # Main iteration loop
-        while iteration < max_iterations:
-            if last_response is None:
+        while ctx.iteration < max_iterations:
+            if history_count < len(ctx.log):
+                new_entries = " ".join(ctx.log[history_count:])
+                history = f"{history} {new_entries}" if history else new_entries
+                history_count = len(ctx.log)
+            
+            if ctx.last_response is None:
                 current_query = query
             else:
-                current_query = query + "\n\n" + " ".join(iteration_response)
-                current_query = current_query + "  What should I do next?"
+                current_query = f"{query}\n\n{history}  What should I do next?"
             
             # Run iteration
             should_stop = await run_iteration(
-                servers,
+                ctx,
+                tool_index,
+                tool_converters,
                 current_query,
-                system_prompt,
+                system_part,
                 client
             )
             if should_stop:
                 break
             
-            iteration += 1
+            ctx.iteration += 1
     
     except Exception as e:
-        print(f"Error in main execution: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error in main execution: {e}")
     finally:
-        reset_state()
+        # Close the persistent server sessions
+        stop_servers.set()
+        await asyncio.gather(*server_tasks.values(), return_exceptions=True)
 
 if __name__ == "__main__":
-    asyncio.run(main()) 
\ No newline at end of file
+    # uvloop is optional (and unavailable on Windows), fall back to the stock loop
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    listener = QueueListener(_log_queue, logging.StreamHandler(sys.stdout))
+    listener.start()
+    try:
+        asyncio.run(main())
+    finally:
+        listener.stop() 
\ No newline at end of file